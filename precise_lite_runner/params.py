@@ -21,39 +21,60 @@ class ListenerParams:
     threshold_config = ((6, 4),)
     threshold_center = 0.2
 
+    _cache_key = None
+    _cache = None
+
+    def _derived(self):
+        """Derived values, recomputed only when a base param changes"""
+        key = (self.window_t, self.hop_t, self.buffer_t, self.sample_rate,
+               self.n_mfcc, self.n_filt, self.use_delta, self.vectorizer)
+        if key != self._cache_key:
+            window_samples = int(self.sample_rate * self.window_t + 0.5)
+            hop_samples = int(self.sample_rate * self.hop_t + 0.5)
+            samples = int(self.sample_rate * self.buffer_t + 0.5)
+            buffer_samples = hop_samples * (samples // hop_samples)
+            n_features = 1 + int(floor(
+                (buffer_samples - window_samples) / hop_samples))
+            num_features = {
+                Vectorizer.mfccs: self.n_mfcc,
+                Vectorizer.mels: self.n_filt,
+                Vectorizer.speechpy_mfccs: self.n_mfcc
+            }[self.vectorizer]
+            if self.use_delta:
+                num_features *= 2
+            self._cache = dict(
+                window_samples=window_samples, hop_samples=hop_samples,
+                buffer_samples=buffer_samples, n_features=n_features,
+                max_samples=int(self.buffer_t * self.sample_rate),
+                feature_size=num_features
+            )
+            self._cache_key = key
+        return self._cache
+
     @property
     def buffer_samples(self):
-        samples = int(self.sample_rate * self.buffer_t + 0.5)
-        return self.hop_samples * (samples // self.hop_samples)
+        return self._derived()['buffer_samples']
 
     @property
     def n_features(self):
-        return 1 + int(floor((self.buffer_samples - self.window_samples) / self.hop_samples))
+        return self._derived()['n_features']
 
     @property
     def window_samples(self):
-        return int(self.sample_rate * self.window_t + 0.5)
+        return self._derived()['window_samples']
 
     @property
     def hop_samples(self):
-        return int(self.sample_rate * self.hop_t + 0.5)
+        return self._derived()['hop_samples']
 
     @property
     def max_samples(self):
-        return int(self.buffer_t * self.sample_rate)
+        return self._derived()['max_samples']
 
     @property
     def feature_size(self):
-        num_features = {
-            Vectorizer.mfccs: self.n_mfcc,
-            Vectorizer.mels: self.n_filt,
-            Vectorizer.speechpy_mfccs: self.n_mfcc
-        }[self.vectorizer]
-        if self.use_delta:
-            num_features *= 2
-        return num_features
+        return self._derived()['feature_size']
 
 
 # Global listener parameters
 params = ListenerParams()
-
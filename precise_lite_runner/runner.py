@@ -1,100 +1,266 @@
 import atexit
+import sys
 import time
-from threading import Thread, Event
+from collections import deque
+from threading import Thread, Condition
 
 import numpy as np
-import pyaudio
-from pyaudio import PyAudio, paInt16
+
+tflite = None
+
+
+def _load_tflite():
+    """Import the tflite interpreter on first use; importing tensorflow
+    takes seconds and isn't needed until a model is actually loaded"""
+    global tflite
+    if tflite is None:
+        try:
+            import tensorflow.lite as tflite
+        except:
+            import tflite_runtime.interpreter as tflite
+    return tflite
+
 
 try:
-    import tensorflow.lite as tflite
-except:
-    import tflite_runtime.interpreter as tflite
+    from numba import njit
+except ImportError:
+    njit = None
 
 from precise_lite_runner.params import params
-from precise_lite_runner.util import buffer_to_audio, ThresholdDecoder
+from precise_lite_runner.util import ThresholdDecoder
 from precise_lite_runner.vectorization import vectorize_raw, add_deltas
 
 
+def _shift_append(buf, new):
+    """Shift buf up by len(new) rows in place and write new at the end
+
+    When new holds at least as many rows as buf, the shift is skipped
+    and the newest rows are copied straight in
+    """
+    n = buf.shape[0]
+    k = new.shape[0]
+    if k >= n:
+        buf[:] = new[k - n:]
+        return
+    buf[:n - k] = buf[k:]
+    buf[n - k:] = new
+
+
+def _detector_steps(activated, activation, trigger_level, refractory):
+    """Step the activation counter through a batch of thresholded chunks
+
+    Returns the per-chunk activation flags and the final counter value
+    """
+    out = np.empty(activated.shape[0], dtype=np.bool_)
+    for i in range(activated.shape[0]):
+        chunk_activated = activated[i]
+        counting = chunk_activated or activation < 0
+        if counting:
+            activation += 1
+        elif activation > 0:
+            activation -= 1
+        has_activated = counting and activation > trigger_level
+        if has_activated or (chunk_activated and activation < 0):
+            activation = refractory
+        out[i] = has_activated
+    return out, activation
+
+
+if njit is not None:
+    _shift_append = njit(cache=True)(_shift_append)
+    _detector_steps = njit(cache=True)(_detector_steps)
+
+
 class TFLiteRunner:
-    def __init__(self, model_name: str):
+    """
+    Runs a tflite wake word model, either float32 or quantized
+
+    Models converted with quantization (e.g. tflite_convert with
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]) expose
+    int8/uint8 tensors; inputs and outputs are (de)quantized here so
+    callers always deal in float32
+    """
+
+    def __init__(self, model_name: str, num_threads: int = None):
         #  Setup tflite environment
-        self.interpreter = tflite.Interpreter(model_path=model_name)
+        # num_threads also sizes the XNNPACK threadpool on runtimes that
+        # apply the delegate by default
+        tflite = _load_tflite()
+        try:
+            self.interpreter = tflite.Interpreter(model_path=model_name,
+                                                  num_threads=num_threads)
+        except TypeError:  # runtime too old for the num_threads kwarg
+            self.interpreter = tflite.Interpreter(model_path=model_name)
         self.interpreter.allocate_tensors()
 
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
+        self._in_idx = self.input_details[0]['index']
+        self._out_idx = self.output_details[0]['index']
+        self._batch = self.input_details[0]['shape'][0]
+        self.input_shape = tuple(self.input_details[0]['shape'])
+        self._in_dtype = self.input_details[0]['dtype']
+        self._out_dtype = self.output_details[0]['dtype']
+        self._in_quant = self.input_details[0].get('quantization', (0.0, 0))
+        self._out_quant = self.output_details[0].get('quantization', (0.0, 0))
+        self._run_buf = None
+        self._out_tensor = self.interpreter.tensor(self._out_idx)
+        self._out_scratch = None
 
     def predict(self, inputs: np.ndarray):
         # Format output to match Keras's model.predict output
-        count = 0
-        output_data = np.ndarray((inputs.shape[0], 1), dtype=np.float32)
-
-        # Support for multiple inputs
-        for input in inputs:
-            # Format as float32. Add a wrapper dimension.
-            current = np.array([input]).astype(np.float32)
-
-            # Load data, run inference and extract output from tensor
-            self.interpreter.set_tensor(self.input_details[0]['index'],
-                                        current)
-            self.interpreter.invoke()
-            output_data[count] = self.interpreter.get_tensor(
-                self.output_details[0]['index'])
-            count += 1
-
-        return output_data
+        # Note: the returned array is a scratch buffer reused by the
+        # next predict call
+        if self._in_dtype in (np.int8, np.uint8):
+            scale, zero_point = self._in_quant
+            info = np.iinfo(self._in_dtype)
+            inputs = np.clip(np.round(inputs / scale) + zero_point,
+                             info.min, info.max).astype(self._in_dtype)
+        else:
+            inputs = inputs.astype(np.float32, copy=False)
+
+        # Resize once per batch size instead of invoking per sample
+        if inputs.shape[0] != self._batch:
+            self.interpreter.resize_tensor_input(self._in_idx,
+                                                 list(inputs.shape))
+            self.interpreter.allocate_tensors()
+            self._batch = inputs.shape[0]
+
+        # Load data, run inference and extract output from tensor
+        self.interpreter.set_tensor(self._in_idx, inputs)
+        self.interpreter.invoke()
+        # Copy out of the interpreter-owned view into a persistent
+        # scratch instead of letting get_tensor allocate a fresh array
+        out_view = self._out_tensor()
+        scratch = self._out_scratch
+        if scratch is None or scratch.shape != out_view.shape:
+            scratch = self._out_scratch = np.empty(out_view.shape,
+                                                   np.float32)
+        if self._out_dtype in (np.int8, np.uint8):
+            scale, zero_point = self._out_quant
+            # dtype= keeps the subtraction in float32; the int8 ufunc
+            # loop would wrap on q - zero_point
+            np.subtract(out_view, zero_point, out=scratch,
+                        dtype=np.float32)
+            scratch *= scale
+        else:
+            scratch[:] = out_view
+        return scratch
 
     def run(self, inp: np.ndarray) -> float:
-        return self.predict(inp[np.newaxis])[0][0]
+        # Reuse a persistent batch-of-one scratch so the per-chunk path
+        # doesn't allocate a wrapper array and float32 copy every call
+        buf = self._run_buf
+        if buf is None or buf.shape[1:] != inp.shape:
+            buf = self._run_buf = np.empty((1,) + inp.shape, np.float32)
+        buf[0] = inp
+        return self.predict(buf)[0][0]
 
 
 class Listener:
     """Listener that preprocesses audio into MFCC vectors
-     and executes neural networks"""
+     and executes neural networks
+
+    Models whose graph includes the feature frontend (converted with the
+    MFCC op baked in, so their input is a rank 2 (1, samples) raw audio
+    tensor) are detected from the input shape and fed a rolling raw
+    audio window, skipping the sonopy preprocessing entirely"""
 
     def __init__(self, model_name: str, chunk_size: int = -1):
-        self.window_audio = np.array([])
-        self.mfccs = np.zeros((params.n_features, params.n_mfcc))
+        self._audio_buf = np.empty(
+            params.buffer_samples + params.window_samples, dtype=np.float32)
+        self._audio_len = 0
+        # float32 matches the model input, so no cast on the invoke path
+        self.mfccs = np.zeros((params.n_features, params.n_mfcc),
+                              dtype=np.float32)
         self.chunk_size = chunk_size
         self.runner = TFLiteRunner(model_name)
+        self._raw_audio_model = len(self.runner.input_shape) == 2
+        if self._raw_audio_model:
+            self._raw_buf = np.zeros(self.runner.input_shape[1],
+                                     dtype=np.float32)
         self.threshold_decoder = ThresholdDecoder(params.threshold_config,
                                                   params.threshold_center)
 
     def clear(self):
-        self.window_audio = np.array([])
-        self.mfccs = np.zeros((params.n_features, params.n_mfcc))
+        self._audio_len = 0
+        self.mfccs[:] = 0
+        if self._raw_audio_model:
+            self._raw_buf[:] = 0
 
-    def update_vectors(self, stream):
+    def _read_stream(self, stream):
         if isinstance(stream, np.ndarray):
-            buffer_audio = stream
+            return stream
+        if isinstance(stream, (bytes, bytearray)):
+            chunk = stream
         else:
-            if isinstance(stream, (bytes, bytearray)):
-                chunk = stream
-            else:
-                chunk = stream.read(self.chunk_size)
-            if len(chunk) == 0:
-                raise EOFError
-            buffer_audio = buffer_to_audio(chunk)
-
-        self.window_audio = np.concatenate((self.window_audio, buffer_audio))
-
-        if len(self.window_audio) >= params.window_samples:
-            new_features = vectorize_raw(self.window_audio)
-            self.window_audio = self.window_audio[
-                                len(new_features) * params.hop_samples:]
-            if len(new_features) > len(self.mfccs):
-                new_features = new_features[-len(self.mfccs):]
-            self.mfccs = np.concatenate(
-                (self.mfccs[len(new_features):], new_features))
+            chunk = stream.read(self.chunk_size)
+        if len(chunk) == 0:
+            raise EOFError
+        # Zero-copy int16 view; scaled to float at the copy-in site
+        return np.frombuffer(chunk, dtype='<i2')
+
+    @staticmethod
+    def _copy_scaled(src, dest):
+        """Write audio into dest, scaling int16 to float as needed"""
+        if src.dtype == np.int16:
+            np.multiply(src, 1.0 / 32768.0, out=dest)
+        else:
+            dest[:] = src
+
+    def update_raw_audio(self, stream):
+        """Roll the raw audio window forward for fused-frontend models"""
+        buffer_audio = self._read_stream(stream)
+        buf = self._raw_buf
+        k = min(len(buffer_audio), len(buf))
+        if k < len(buf):
+            buf[:-k] = buf[k:]
+        self._copy_scaled(buffer_audio[-k:], buf[-k:])
+        return buf
+
+    def update_vectors(self, stream):
+        buffer_audio = self._read_stream(stream)
+
+        # Copy the new samples into the preallocated buffer rather than
+        # reallocating with np.concatenate on every chunk. Overflowing
+        # audio is dropped in whole hops so the mfcc framing phase stays
+        # aligned with what an unbounded buffer would produce
+        hop = params.hop_samples
+        cap = len(self._audio_buf)
+        n = len(buffer_audio)
+        if n > cap:
+            drop = ((n - cap + hop - 1) // hop) * hop
+            buffer_audio = buffer_audio[drop:]
+            n -= drop
+        if self._audio_len + n > cap:
+            drop = min(((self._audio_len + n - cap + hop - 1) // hop) * hop,
+                       self._audio_len)
+            keep = self._audio_len - drop
+            self._audio_buf[:keep] = self._audio_buf[drop:self._audio_len]
+            self._audio_len = keep
+        self._copy_scaled(buffer_audio,
+                          self._audio_buf[self._audio_len:self._audio_len + n])
+        self._audio_len += n
+
+        if self._audio_len >= params.window_samples:
+            new_features = vectorize_raw(self._audio_buf[:self._audio_len])
+            consumed = len(new_features) * params.hop_samples
+            remaining = self._audio_len - consumed
+            self._audio_buf[:remaining] = self._audio_buf[
+                                          consumed:self._audio_len]
+            self._audio_len = remaining
+            _shift_append(self.mfccs, new_features)
 
         return self.mfccs
 
     def update(self, stream):
-        mfccs = self.update_vectors(stream)
-        if params.use_delta:
-            mfccs = add_deltas(mfccs)
-        raw_output = self.runner.run(mfccs)
+        if self._raw_audio_model:
+            raw_output = self.runner.run(self.update_raw_audio(stream))
+        else:
+            mfccs = self.update_vectors(stream)
+            if params.use_delta:
+                mfccs = add_deltas(mfccs)
+            raw_output = self.runner.run(mfccs)
         return self.threshold_decoder.decode(raw_output)
 
     def get_prediction(self, chunk):
@@ -108,33 +274,71 @@ class ReadWriteStream:
     """
 
     def __init__(self, s=b'', chop_samples=-1):
-        self.buffer = s
-        self.write_event = Event()
+        self._chunks = deque()
+        self._nbytes = 0
+        self._head_off = 0
+        if s:
+            self._chunks.append(s)
+            self._nbytes = len(s)
+        self._cond = Condition()
         self.chop_samples = chop_samples
 
     def __len__(self):
-        return len(self.buffer)
+        return self._nbytes - self._head_off
+
+    def _discard(self, n):
+        """Drop the n oldest buffered bytes without copying"""
+        while n > 0 and self._chunks:
+            avail = len(self._chunks[0]) - self._head_off
+            if avail <= n:
+                self._nbytes -= len(self._chunks.popleft())
+                self._head_off = 0
+                n -= avail
+            else:
+                self._head_off += n
+                n = 0
+
+    def _take(self, n):
+        """Remove and return the n oldest buffered bytes"""
+        parts = []
+        while n > 0:
+            chunk = self._chunks[0]
+            avail = len(chunk) - self._head_off
+            if avail <= n:
+                parts.append(chunk[self._head_off:] if self._head_off
+                             else chunk)
+                self._nbytes -= len(self._chunks.popleft())
+                self._head_off = 0
+                n -= avail
+            else:
+                parts.append(chunk[self._head_off:self._head_off + n])
+                self._head_off += n
+                n = 0
+        return b''.join(parts)
 
     def read(self, n=-1, timeout=None):
-        if n == -1:
-            n = len(self.buffer)
-        if 0 < self.chop_samples < len(self.buffer):
-            samples_left = len(self.buffer) % self.chop_samples
-            self.buffer = self.buffer[-samples_left:]
-        return_time = 1e10 if timeout is None else (
-                timeout + time.time()
-        )
-        while len(self.buffer) < n:
-            self.write_event.clear()
-            if not self.write_event.wait(return_time - time.time()):
-                return b''
-        chunk = self.buffer[:n]
-        self.buffer = self.buffer[n:]
-        return chunk
+        with self._cond:
+            if n == -1:
+                n = len(self)
+            if 0 < self.chop_samples < len(self):
+                samples_left = len(self) % self.chop_samples
+                if samples_left:
+                    self._discard(len(self) - samples_left)
+            return_time = None if timeout is None else (
+                    timeout + time.time()
+            )
+            while len(self) < n:
+                remaining = None if return_time is None else (
+                        return_time - time.time())
+                if not self._cond.wait(remaining):
+                    return b''
+            return self._take(n)
 
     def write(self, s):
-        self.buffer += s
-        self.write_event.set()
+        with self._cond:
+            self._chunks.append(bytes(s))
+            self._nbytes += len(s)
+            self._cond.notify_all()
 
     def flush(self):
         """Makes compatible with sys.stdout"""
@@ -153,23 +357,41 @@ class TriggerDetector:
         self.sensitivity = sensitivity
         self.trigger_level = trigger_level
         self.activation = 0
+        # Negative counter value entered after an activation; it counts
+        # back up to zero, suppressing re-triggers for ~8 chunks of 2048
+        self._refractory = -(8 * 2048) // self.chunk_size
 
     def update(self, prob):
         # type: (float) -> bool
         """Returns whether the new prediction caused an activation"""
-        chunk_activated = prob > 1.0 - self.sensitivity
+        return self._step(prob > 1.0 - self.sensitivity)
 
-        if chunk_activated or self.activation < 0:
-            self.activation += 1
-            has_activated = self.activation > self.trigger_level
-            if has_activated or chunk_activated and self.activation < 0:
-                self.activation = -(8 * 2048) // self.chunk_size
+    def update_batch(self, probs):
+        # type: (np.ndarray) -> np.ndarray
+        """Returns a bool array of activations for a batch of predictions
 
-            if has_activated:
-                return True
-        elif self.activation > 0:
-            self.activation -= 1
-        return False
+        The sensitivity thresholding runs as one vectorized comparison
+        and the counter steps through the batch in a jitted loop when
+        numba is available
+        """
+        activated = np.asarray(probs) > 1.0 - self.sensitivity
+        out, self.activation = _detector_steps(
+            activated, self.activation, self.trigger_level,
+            self._refractory)
+        return out
+
+    def _step(self, chunk_activated):
+        # type: (bool) -> bool
+        activation = self.activation
+        counting = chunk_activated or activation < 0
+        # Count up while activated or refractory, otherwise decay
+        # toward zero, saturating there
+        activation += 1 if counting else -(activation > 0)
+        has_activated = counting and activation > self.trigger_level
+        if has_activated or (chunk_activated and activation < 0):
+            activation = self._refractory
+        self.activation = activation
+        return has_activated
 
 
 class PreciseRunner:
@@ -195,6 +417,7 @@ class PreciseRunner:
         self.chunk_size = self.listener.chunk_size
 
         self.pa = None
+        self._pa_stream = None
         self.thread = None
         self.running = False
         self.detector = TriggerDetector(self.chunk_size, sensitivity,
@@ -206,16 +429,37 @@ class PreciseRunner:
         pyaudio.Stream.read takes samples as n, not bytes
         so read(n) should be read(n // sample_depth)
         """
-
+        # Only a stream created through pyaudio needs wrapping, and one
+        # can only exist if pyaudio has already been imported
+        pyaudio = sys.modules.get('pyaudio')
+        if pyaudio is None:
+            return
         if getattr(stream.read, '__func__', None) is pyaudio.Stream.read:
-            stream.read = lambda x: pyaudio.Stream.read(stream, x // 2, False)
+            # Bind the target function and stream as defaults so each
+            # call is pure local loads, with no global or attribute
+            # lookups left on the per-chunk path
+            stream.read = lambda x, _read=pyaudio.Stream.read, _s=stream: \
+                _read(_s, x // 2, False)
 
     def start(self):
         """Start listening from stream"""
         if self.stream is None:
+            from pyaudio import PyAudio, paInt16, paContinue
+
+            # Capture in callback mode: the portaudio thread just queues
+            # bytes so a slow prediction never blocks the device, and the
+            # chop bound drops stale audio instead of growing the backlog
             self.pa = PyAudio()
-            self.stream = self.pa.open(
-                16000, 1, paInt16, True, frames_per_buffer=self.chunk_size
+            self.stream = ReadWriteStream(
+                chop_samples=16 * self.chunk_size)
+
+            def put_chunk(in_data, frame_count, time_info, status):
+                self.stream.write(in_data)
+                return None, paContinue
+
+            self._pa_stream = self.pa.open(
+                16000, 1, paInt16, True, frames_per_buffer=self.chunk_size,
+                stream_callback=put_chunk
             )
 
         self._wrap_stream_read(self.stream)
@@ -235,19 +479,28 @@ class PreciseRunner:
             self.thread = None
 
         if self.pa:
+            self._pa_stream.stop_stream()
+            self._pa_stream.close()
             self.pa.terminate()
-            self.stream.stop_stream()
-            self.stream = self.pa = None
+            self.stream = self.pa = self._pa_stream = None
 
     def _handle_predictions(self):
         """Continuously check Precise process output"""
+        # Bind the per-chunk lookups once instead of resolving four
+        # attribute chains on every iteration
+        read = self.stream.read
+        get_prediction = self.listener.get_prediction
+        on_prediction = self.on_prediction
+        detector_update = self.detector.update
+        on_activation = self.on_activation
+        chunk_size = self.chunk_size
         while self.running:
             # t0 = time.time()
-            chunk = self.stream.read(self.chunk_size)
+            chunk = read(chunk_size)
 
-            prob = self.listener.get_prediction(chunk)
-            self.on_prediction(prob)
-            if self.detector.update(prob):
-                self.on_activation()
+            prob = get_prediction(chunk)
+            on_prediction(prob)
+            if detector_update(prob):
+                on_activation()
             # t1 = time.time()
             # print("Prediction time: %.4f" % ((t1-t0)))
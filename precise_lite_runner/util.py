@@ -19,20 +19,23 @@ class ThresholdDecoder:
         self.out_range = self.max_out - self.min_out
         self.cd = np.cumsum(self._calc_pd(mu_stds, resolution))
         self.center = center
+        # Fold the piecewise center mapping into the table so decoding
+        # is a single lookup after the logit
+        self._decode_table = np.where(
+            self.cd < center, 0.5 * self.cd / center,
+            0.5 + 0.5 * (self.cd - center) / (1 - center))
 
     def decode(self, raw_output: float) -> float:
         if raw_output == 1.0 or raw_output == 0.0:
             return raw_output
         if self.out_range == 0:
             cp = int(raw_output > self.min_out)
-        else:
-            ratio = (asigmoid(raw_output) - self.min_out) / self.out_range
-            ratio = min(max(ratio, 0.0), 1.0)
-            cp = self.cd[int(ratio * (len(self.cd) - 1) + 0.5)]
-        if cp < self.center:
-            return 0.5 * cp / self.center
-        else:
+            if cp < self.center:
+                return 0.5 * cp / self.center
             return 0.5 + 0.5 * (cp - self.center) / (1 - self.center)
+        ratio = (asigmoid(raw_output) - self.min_out) / self.out_range
+        ratio = min(max(ratio, 0.0), 1.0)
+        return self._decode_table[int(ratio * (len(self.cd) - 1) + 0.5)]
 
     def encode(self, threshold: float) -> float:
         threshold = 0.5 * threshold / self.center
@@ -74,5 +77,5 @@ def pdf(x, mu, std):
 
 def buffer_to_audio(buffer: bytes) -> np.ndarray:
     """Convert a raw mono audio byte string to numpy array of floats"""
-    return np.fromstring(buffer, dtype='<i2').astype(np.float32,
+    return np.frombuffer(buffer, dtype='<i2').astype(np.float32,
                                                      order='C') / 32768.0
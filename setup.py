@@ -7,8 +7,9 @@ setup(
     url='https://github.com/OpenVoiceOS/precise_lite_runner',
     license='Apache-2.0',
     install_requires=["sonopy==0.1.2",
-                      "pyaudio"],
+                      "tflite-runtime"],
     extras_require={
+        'mic': [ "pyaudio" ],
         'tflite': [ "tflite-runtime" ],
         'full': [ "tensorflow" ]
     },